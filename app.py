@@ -4,10 +4,13 @@ Flask web application for Robot Dog Controller.
 Provides WebSocket-based real-time control interface.
 """
 
-from flask import Flask, render_template, jsonify
+from flask import Flask, Response, render_template, request
 from flask_socketio import SocketIO, emit
+import json
+import os
 import threading
 import time
+import uuid
 import logging
 
 # Configure logging
@@ -17,41 +20,114 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'robot-dog-controller-2024'
 
-# Use eventlet for async WebSocket handling if available, otherwise threading
+# Use real OS threads: eventlet's monkey patching turns the blocking I2C
+# calls into greenlet stalls and changes threading.Lock semantics.
+async_mode = 'threading'
+
+# Use orjson for Socket.IO payloads when available
 try:
-    import eventlet
-    eventlet.monkey_patch()
-    async_mode = 'eventlet'
+    import orjson
+
+    class OrjsonAdapter:
+        """json-module shim over orjson for python-socketio (str in/out)."""
+
+        @staticmethod
+        def dumps(obj, *args, **kwargs):
+            return orjson.dumps(obj).decode('utf-8')
+
+        @staticmethod
+        def loads(s, *args, **kwargs):
+            return orjson.loads(s)
+
+    socketio_json = {'json': OrjsonAdapter}
 except ImportError:
-    async_mode = 'threading'
+    socketio_json = {}
 
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode,
+                    **socketio_json)
 
 # Import robot controller
-from robot_controller import RobotController
+from robot_controller import I2C_WORKER_CPU, RobotController
 robot = RobotController(i2c_addr=0x08, bus_num=1)
 
 
 class SendThrottle:
-    """Rate limiter for I2C sends (100ms interval like original)."""
+    """
+    Rate limiter for I2C sends (100ms interval like original).
+    Lock-free: relies on the GIL making the single-slot store atomic.
+    """
 
     def __init__(self, interval=0.1):
-        self.interval = interval
-        self.last_send = 0
-        self.lock = threading.Lock()
+        self.interval_ns = int(interval * 1_000_000_000)
+        self._last = [0]
 
     def should_send(self):
-        with self.lock:
-            now = time.time()
-            if now - self.last_send >= self.interval:
-                self.last_send = now
-                return True
-            return False
+        now = time.monotonic_ns()
+        if now - self._last[0] >= self.interval_ns:
+            self._last[0] = now
+            return True
+        return False
 
 
 throttle = SendThrottle()
 
 
+# ============== Coalesced Broadcast ==============
+
+BROADCAST_INTERVAL = 0.05  # 20 Hz
+
+# State keys ('left_leg', 'right_joint', ...) changed since the last tick,
+# mapped to the sid of the client that last changed them
+_dirty_parts = {}
+_dirty_lock = threading.Lock()
+_broadcast_started = False
+_broadcast_lock = threading.Lock()
+
+
+def _mark_dirty(part, sid):
+    """Schedule a part's angle for the next broadcast tick."""
+    with _dirty_lock:
+        _dirty_parts[part] = sid
+
+
+def _broadcast_loop():
+    """
+    Flush pending changes to all clients at a fixed tick.
+    Emits a 'state_patch' with only the changed parts' angles; clients
+    receive the full snapshot via 'state_update' on connect. A part is not
+    echoed back to the client that changed it, since that client already
+    shows its own value.
+    """
+    while True:
+        socketio.sleep(BROADCAST_INTERVAL)
+        if not _dirty_parts:
+            continue
+        with _dirty_lock:
+            dirty = dict(_dirty_parts)
+            _dirty_parts.clear()
+        # Never let one bad tick end the only broadcast path
+        try:
+            state = robot.get_state_dict()
+            patches = {}
+            for part, sid in dirty.items():
+                patches.setdefault(sid, {})[part] = {'angle': state[part]['angle']}
+            for sid, patch in patches.items():
+                # Straight to the underlying Socket.IO server: no Flask context needed
+                socketio.server.emit('state_patch', patch, namespace='/',
+                                     skip_sid=sid)
+        except Exception:
+            logger.exception('State broadcast failed')
+
+
+def _ensure_broadcast_loop():
+    """Start the broadcast loop once, on the first client connection."""
+    global _broadcast_started
+    with _broadcast_lock:
+        if not _broadcast_started:
+            _broadcast_started = True
+            socketio.start_background_task(_broadcast_loop)
+
+
 # ============== HTTP Routes ==============
 
 @app.route('/')
@@ -60,20 +136,34 @@ def index():
     return render_template('index.html')
 
 
+# Per-process nonce so ETags from before a restart never match new state
+BOOT_ID = uuid.uuid4().hex
+
+
 @app.route('/api/status')
 def api_status():
-    """REST endpoint for current robot state."""
-    return jsonify(robot.get_state_dict())
+    """
+    REST endpoint for current robot state.
+    Tagged with the state version so pollers get 304 until something changes.
+    """
+    version = robot.version
+    response = Response(robot.get_state_json(), mimetype='application/json')
+    response.set_etag(f'{BOOT_ID}-{version}')
+    return response.make_conditional(request)
+
+
+# Neither the bus handle nor the async mode changes after startup
+_health_body = json.dumps({
+    'status': 'ok',
+    'i2c_available': robot.bus is not None,
+    'async_mode': async_mode
+})
 
 
 @app.route('/api/health')
 def api_health():
     """Health check endpoint."""
-    return jsonify({
-        'status': 'ok',
-        'i2c_available': robot.bus is not None,
-        'async_mode': async_mode
-    })
+    return Response(_health_body, mimetype='application/json')
 
 
 # ============== WebSocket Events ==============
@@ -82,6 +172,7 @@ def api_health():
 def handle_connect():
     """Handle client connection - send current state."""
     logger.info('Client connected')
+    _ensure_broadcast_loop()
     emit('state_update', robot.get_state_dict())
 
 
@@ -97,6 +188,43 @@ def handle_get_status():
     emit('state_update', robot.get_state_dict())
 
 
+def _after_update(changed, part):
+    """Send to I2C (throttled) and schedule a broadcast after a part update."""
+    # Unchanged means invalid or below display resolution: nothing to do
+    if changed:
+        if throttle.should_send():
+            robot.send_data_safe()
+        # Schedule the changed part for the next broadcast tick
+        _mark_dirty(part, request.sid)
+
+
+@socketio.on('cmd')
+def handle_cmd(buf):
+    """
+    Handle binary angle update (used by the web UI).
+    Expects 3 bytes: opcode 0-3 (bit 1: joint, bit 0: right side),
+    then int16 little-endian angle x10. Other opcodes are rejected.
+    """
+    if not isinstance(buf, (bytes, bytearray)) or len(buf) != 3:
+        emit('error', {'message': 'Invalid command frame'})
+        return
+
+    op = buf[0]
+    if op > 3:
+        emit('error', {'message': 'Invalid command frame'})
+        return
+
+    side = 'right' if op & 1 else 'left'
+    angle = int.from_bytes(buf[1:3], 'little', signed=True) / 10.0
+
+    if op & 2:
+        success, changed, msg = robot.set_joint(side, angle)
+        _after_update(changed, f'{side}_joint')
+    else:
+        success, changed, msg = robot.set_leg(side, angle)
+        _after_update(changed, f'{side}_leg')
+
+
 @socketio.on('set_leg')
 def handle_set_leg(data):
     """
@@ -110,13 +238,8 @@ def handle_set_leg(data):
         emit('error', {'message': 'Invalid leg data'})
         return
 
-    success, msg = robot.set_leg(side, angle)
-
-    if success and throttle.should_send():
-        robot.send_data_safe()
-
-    # Broadcast updated state to all clients
-    emit('state_update', robot.get_state_dict(), broadcast=True)
+    success, changed, msg = robot.set_leg(side, angle)
+    _after_update(changed, f'{side}_leg')
 
 
 @socketio.on('set_joint')
@@ -132,20 +255,14 @@ def handle_set_joint(data):
         emit('error', {'message': 'Invalid joint data'})
         return
 
-    success, msg = robot.set_joint(side, angle)
-
-    if success and throttle.should_send():
-        robot.send_data_safe()
-
-    # Broadcast updated state to all clients
-    emit('state_update', robot.get_state_dict(), broadcast=True)
+    success, changed, msg = robot.set_joint(side, angle)
+    _after_update(changed, f'{side}_joint')
 
 
 @socketio.on('send_now')
 def handle_send_now():
-    """Force immediate I2C send."""
+    """Force immediate I2C send (state is unchanged, so nothing to broadcast)."""
     robot.send_data_safe()
-    emit('state_update', robot.get_state_dict(), broadcast=True)
 
 
 # ============== Main ==============
@@ -156,4 +273,14 @@ if __name__ == '__main__':
     logger.info('Access at http://0.0.0.0:5000')
     logger.info('In AP mode: http://192.168.4.1:5000')
 
-    socketio.run(app, host='0.0.0.0', port=5000, debug=False)
+    # Keep the web server off the I2C worker's CPU (threads created from
+    # here on inherit this mask)
+    if hasattr(os, 'sched_setaffinity'):
+        cpus = os.sched_getaffinity(0) - {I2C_WORKER_CPU}
+        if cpus:
+            os.sched_setaffinity(0, cpus)
+
+    # Threading mode is served by Werkzeug, which Flask-SocketIO refuses to
+    # run outside debug unless explicitly allowed.
+    socketio.run(app, host='0.0.0.0', port=5000, debug=False,
+                 allow_unsafe_werkzeug=True)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Minimal raw i2c-dev writer that releases the GIL during the transfer.
+smbus.write_i2c_block_data holds the GIL for the whole ioctl; os.write on
+an i2c-dev fd does not, so other threads keep running during the ~1 ms
+bus transaction.
+"""
+
+import fcntl
+import os
+
+# From linux/i2c-dev.h
+I2C_SLAVE = 0x0703
+
+
+def open_bus(bus_num, address):
+    """
+    Open /dev/i2c-<bus_num> and bind it to the slave address.
+    Returns the file descriptor; raises OSError if the bus is unavailable.
+    """
+    fd = os.open(f"/dev/i2c-{bus_num}", os.O_RDWR)
+    try:
+        fcntl.ioctl(fd, I2C_SLAVE, address)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+def write(fd, frame):
+    """
+    Write a raw frame to the bound slave.
+    A frame of [register] + data is the same bus transaction as
+    smbus.write_i2c_block_data(address, register, data).
+    """
+    written = os.write(fd, frame)
+    if written != len(frame):
+        raise OSError(f"short I2C write ({written}/{len(frame)} bytes)")
@@ -2,27 +2,77 @@
 """
 Thread-safe robot controller for Flask web application.
 Extracted and adapted from Raspberry_Master_CLI.py
+
+Fully type-annotated so it can be compiled with mypyc for the per-event
+hot path (see README); the pure-Python module is used when no compiled
+extension is present.
 """
 
+import json
+import logging
+import os
+import queue
 import threading
 import time
+from typing import Dict, List, Optional, Tuple
 
-# Try to import smbus; if not available, run in "dry" mode
+# Prefer orjson for state serialization; fall back to the stdlib encoder
 try:
-    import smbus
+    import orjson  # type: ignore
 except ImportError:
-    smbus = None
+    orjson = None  # type: ignore
+
+import i2c_write
+
+logger = logging.getLogger(__name__)
+
+# Changes smaller than this are below the UI's 0.1° display resolution
+MIN_ANGLE_DELTA = 0.05
+
+# CPU the I2C worker is pinned to (skipped if not available), and its
+# SCHED_FIFO priority (needs CAP_SYS_NICE or an RLIMIT_RTPRIO of at least this)
+I2C_WORKER_CPU = 1
+I2C_WORKER_FIFO_PRIORITY = 10
+
+# Index of each side's leg in the part arrays; its joint follows at +1
+LEG_IDX: Dict[str, int] = {"left": 0, "right": 2}
 
 
-class RobotPart:
-    """Represents a single robot part (leg or joint)."""
+def _pad3(buf: bytearray, off: int, v: int) -> None:
+    """
+    Write int v into buf[off:off+3] right-aligned, space-padded (like f"{v:3}").
+    Valid for -99..999, which covers all leg and joint angles.
+    """
+    sign = 0x2D if v < 0 else 0x20
+    if v < 0:
+        v = -v
+    if v >= 100:
+        buf[off] = 0x30 + v // 100
+        buf[off + 1] = 0x30 + (v // 10) % 10
+    elif v >= 10:
+        buf[off] = sign
+        buf[off + 1] = 0x30 + v // 10
+    else:
+        buf[off] = 0x20
+        buf[off + 1] = sign
+    buf[off + 2] = 0x30 + v % 10
+
 
-    def __init__(self, label, angle=0.0, is_joint=False):
-        self.label = label
-        self.angle = float(angle)
-        self.is_joint = is_joint
-        self.relative_angle = 0.0 if is_joint else None
-        self.initial_angle = float(angle)
+def _configure_i2c_thread() -> None:
+    """Pin the calling thread to I2C_WORKER_CPU and try to make it SCHED_FIFO."""
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        if I2C_WORKER_CPU in os.sched_getaffinity(0):
+            os.sched_setaffinity(0, {I2C_WORKER_CPU})
+    except OSError as e:
+        logger.warning("Could not pin I2C worker to CPU %d: %s", I2C_WORKER_CPU, e)
+    try:
+        os.sched_setscheduler(0, os.SCHED_FIFO,
+                              os.sched_param(I2C_WORKER_FIFO_PRIORITY))
+    except OSError as e:
+        logger.warning("SCHED_FIFO unavailable for I2C worker, using default "
+                       "scheduling (needs CAP_SYS_NICE or LimitRTPRIO): %s", e)
 
 
 class RobotController:
@@ -31,143 +81,203 @@ class RobotController:
     Controls 2 legs and 2 joints via I2C to Teensy.
     """
 
-    def __init__(self, i2c_addr=0x08, bus_num=1):
+    def __init__(self, i2c_addr: int = 0x08, bus_num: int = 1) -> None:
         self.address = i2c_addr
         self.i2c_lock = threading.Lock()
-        self.last_send_time = 0.0
+        self.state_lock = threading.Lock()
+        self.last_send_time: float = 0.0
 
         # Initial leg angle
         START_LEG_ANGLE = 45.0
 
-        # Create parts: [left_leg, left_joint, right_leg, right_joint]
-        self.parts = [
-            RobotPart("Left Leg", angle=START_LEG_ANGLE),
-            RobotPart("Left Joint", angle=START_LEG_ANGLE, is_joint=True),
-            RobotPart("Right Leg", angle=START_LEG_ANGLE),
-            RobotPart("Right Joint", angle=START_LEG_ANGLE, is_joint=True),
-        ]
-
-        # Align joints to legs (relative_angle = 0)
-        for leg_idx in (0, 2):
-            leg = self.parts[leg_idx]
-            joint = self.parts[leg_idx + 1]
-            joint.relative_angle = 0.0
-            joint.angle = leg.angle + joint.relative_angle
-
-        # Initialize I2C bus
-        self.bus = None
-        if smbus:
+        # Struct-of-arrays part state: [left_leg, left_joint, right_leg, right_joint]
+        # angles holds absolute angles; relatives holds joint angles relative
+        # to their leg (always 0.0 for legs).
+        self.labels: Tuple[str, ...] = ("Left Leg", "Left Joint", "Right Leg", "Right Joint")
+        self.angles: List[float] = [START_LEG_ANGLE] * 4
+        self.initials: List[float] = list(self.angles)
+        self.relatives: List[float] = [0.0] * 4
+
+        # Allowed leg range (initial +/- 60), precomputed for set_leg
+        self._leg_min: List[float] = [a - 60.0 for a in self.initials]
+        self._leg_max: List[float] = [a + 60.0 for a in self.initials]
+
+        # Prebuilt state dict (updated in place) and cached JSON encoding
+        self._state: Dict[str, Dict[str, float]] = {
+            'left_leg': {
+                'angle': self.angles[0],
+                'initial': self.initials[0]
+            },
+            'left_joint': {
+                'angle': self.relatives[1]
+            },
+            'right_leg': {
+                'angle': self.angles[2],
+                'initial': self.initials[2]
+            },
+            'right_joint': {
+                'angle': self.relatives[3]
+            }
+        }
+        self._state_json: Optional[bytes] = None
+        # Incremented on every state change; used as the /api/status ETag
+        self.version: int = 0
+
+        # Raw I2C frame: register byte 0 + fixed-width Teensy string,
+        # rewritten in place on every send and written to the bus as-is
+        self._i2c_payload: bytearray = bytearray(b"\x00  0/  0/  0/  0")
+
+        # Initialize I2C bus (raw i2c-dev fd); if unavailable, run in "dry" mode
+        self.bus: Optional[int] = None
+        if os.path.exists(f"/dev/i2c-{bus_num}"):
             try:
-                self.bus = smbus.SMBus(bus_num)
+                self.bus = i2c_write.open_bus(bus_num, self.address)
                 time.sleep(0.01)
             except Exception as e:
-                print(f"Failed to initialize I2C bus: {e}")
+                logger.warning("Failed to initialize I2C bus: %s", e)
                 self.bus = None
 
-    def set_leg(self, side, angle):
+        # Dedicated I2C worker; a full queue means a send is already pending
+        self._send_q: "queue.Queue[int]" = queue.Queue(maxsize=1)
+        self._i2c_thread = threading.Thread(target=self._i2c_worker, daemon=True)
+        self._i2c_thread.start()
+
+    def set_leg(self, side: str, angle: object) -> Tuple[bool, bool, str]:
         """
         Set leg absolute angle within ±60° of initial (45°).
-        Returns (success, message) tuple.
+        No wraparound is applied; clients must send angles already
+        normalized to the [-15, 105] range.
+        Returns (success, changed, message) tuple; changed is False when the
+        change is below display resolution and state was left untouched.
         """
-        idx = 0 if side == "left" else 2
-        leg = self.parts[idx]
-        angle = float(angle)
+        idx = LEG_IDX[side]
+        # Accept whatever the JSON events send (int, float, numeric str)
+        angle_f = float(angle)  # type: ignore[arg-type]
 
         # Check if within allowed range
-        angle_diff = ((angle - leg.initial_angle + 180) % 360) - 180
-        if -60 <= angle_diff <= 60:
-            leg.angle = angle
-            # Update joint absolute angle
-            joint = self.parts[idx + 1]
-            joint.angle = leg.angle + joint.relative_angle
-            return True, f"{leg.label} set to {leg.angle:.1f}"
-        return False, "Angle out of allowed range (45 +/- 60)"
-
-    def set_joint(self, side, rel_angle):
+        if self._leg_min[idx] <= angle_f <= self._leg_max[idx]:
+            if abs(angle_f - self.angles[idx]) < MIN_ANGLE_DELTA:
+                return True, False, f"{self.labels[idx]} unchanged"
+            with self.state_lock:
+                self.angles[idx] = angle_f
+                # Update joint absolute angle
+                self.angles[idx + 1] = angle_f + self.relatives[idx + 1]
+                self._state[f"{side}_leg"]['angle'] = angle_f
+                self._state_json = None
+                self.version += 1
+            return True, True, f"{self.labels[idx]} set to {angle_f:.1f}"
+        return False, False, "Angle out of allowed range (45 +/- 60)"
+
+    def set_joint(self, side: str, rel_angle: object) -> Tuple[bool, bool, str]:
         """
         Set joint relative angle [0..60] degrees.
-        Returns (success, message) tuple.
+        Returns (success, changed, message) tuple; changed is False when the
+        change is below display resolution and state was left untouched.
         """
-        idx = 1 if side == "left" else 3
-        joint = self.parts[idx]
-        rel_angle = float(rel_angle)
-
-        if 0.0 <= rel_angle <= 60.0:
-            joint.relative_angle = rel_angle
-            leg = self.parts[idx - 1]
-            joint.angle = leg.angle + joint.relative_angle
-            return True, f"{joint.label} relative angle set to {joint.relative_angle:.1f}"
-        return False, "Relative angle must be between 0 and 60"
-
-    def get_state_dict(self):
-        """Return JSON-serializable state for all parts."""
-        return {
-            'left_leg': {
-                'angle': self.parts[0].angle,
-                'initial': self.parts[0].initial_angle
-            },
-            'left_joint': {
-                'angle': self.parts[1].relative_angle
-            },
-            'right_leg': {
-                'angle': self.parts[2].angle,
-                'initial': self.parts[2].initial_angle
-            },
-            'right_joint': {
-                'angle': self.parts[3].relative_angle
-            }
-        }
+        idx = LEG_IDX[side] + 1
+        rel_angle_f = float(rel_angle)  # type: ignore[arg-type]
+
+        if 0.0 <= rel_angle_f <= 60.0:
+            if abs(rel_angle_f - self.relatives[idx]) < MIN_ANGLE_DELTA:
+                return True, False, f"{self.labels[idx]} unchanged"
+            with self.state_lock:
+                self.relatives[idx] = rel_angle_f
+                self.angles[idx] = self.angles[idx - 1] + rel_angle_f
+                self._state[f"{side}_joint"]['angle'] = rel_angle_f
+                self._state_json = None
+                self.version += 1
+            return True, True, f"{self.labels[idx]} relative angle set to {rel_angle_f:.1f}"
+        return False, False, "Relative angle must be between 0 and 60"
 
-    def format_send_string(self):
+    def get_state_dict(self) -> Dict[str, Dict[str, float]]:
         """
-        Format data string for Teensy.
+        Return JSON-serializable state for all parts.
+        The dict is shared and updated in place; callers must not mutate it.
+        """
+        return self._state
+
+    def get_state_json(self) -> bytes:
+        """Return state as UTF-8 JSON bytes, cached until the next mutation."""
+        with self.state_lock:
+            state_json = self._state_json
+            if state_json is None:
+                if orjson is not None:
+                    state_json = orjson.dumps(self._state)
+                else:
+                    state_json = json.dumps(self._state).encode("utf-8")
+                self._state_json = state_json
+            return state_json
+
+    def format_send_string(self) -> bytearray:
+        """
+        Format data for Teensy into the preallocated I2C payload.
         Format: "left_joint/left_leg/right_joint/right_leg"
         Each value is 3-character padded integer.
+        Returns the shared payload: register byte 0 + 15 ASCII bytes.
+        """
+        buf = self._i2c_payload
+        angles = self.angles
+        relatives = self.relatives
+        _pad3(buf, 1, int(round(relatives[1])))
+        _pad3(buf, 5, int(round(angles[0])))
+        _pad3(buf, 9, int(round(relatives[3])))
+        _pad3(buf, 13, int(round(angles[2])))
+        return buf
+
+    def send_data(self) -> bool:
         """
-        left_joint = int(round(self.parts[1].relative_angle))
-        left_leg = int(round(self.parts[0].angle))
-        right_joint = int(round(self.parts[3].relative_angle))
-        right_leg = int(round(self.parts[2].angle))
-        return f"{left_joint:3}/{left_leg:3}/{right_joint:3}/{right_leg:3}"
-
-    def send_data(self):
-        """Send current state to Teensy via I2C (not thread-safe)."""
-        send_str = self.format_send_string()
-        print(f"SEND: {send_str}")
-
-        if self.bus:
+        Send current state to Teensy via I2C.
+        Only the bus write is held under i2c_lock; formatting happens outside.
+        """
+        payload = self.format_send_string()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("SEND: %s", payload[1:].decode("ascii"))
+
+        if self.bus is not None:
             try:
-                data_bytes = send_str.encode("utf-8")
-                self.bus.write_i2c_block_data(self.address, 0, list(data_bytes))
+                with self.i2c_lock:
+                    i2c_write.write(self.bus, payload)
                 self.last_send_time = time.time()
                 return True
             except Exception as e:
-                print(f"I2C write failed: {e}")
+                logger.warning("I2C write failed: %s", e)
                 return False
         else:
-            print("(dry run, no I2C bus available)")
+            logger.debug("(dry run, no I2C bus available)")
             self.last_send_time = time.time()
             return True
 
-    def send_data_safe(self):
-        """Thread-safe I2C send."""
-        with self.i2c_lock:
-            return self.send_data()
+    def _i2c_worker(self) -> None:
+        """Perform queued I2C sends off the request path."""
+        _configure_i2c_thread()
+        while True:
+            self._send_q.get()
+            self.send_data()
+
+    def send_data_safe(self) -> None:
+        """
+        Thread-safe I2C send. Schedules a send on the I2C worker and
+        returns immediately; requests made while one is pending coalesce.
+        """
+        try:
+            self._send_q.put_nowait(1)
+        except queue.Full:
+            pass
 
 
 # For testing without Flask
 if __name__ == "__main__":
     controller = RobotController()
     print("Initial state:", controller.get_state_dict())
-    print("Send string:", controller.format_send_string())
+    print("Send string:", controller.format_send_string()[1:].decode("ascii"))
 
     # Test setting leg
-    success, msg = controller.set_leg("left", 60)
+    success, changed, msg = controller.set_leg("left", 60)
     print(f"Set left leg to 60: {msg}")
     print("State:", controller.get_state_dict())
 
     # Test setting joint
-    success, msg = controller.set_joint("left", 30)
+    success, changed, msg = controller.set_joint("left", 30)
     print(f"Set left joint to 30: {msg}")
     print("State:", controller.get_state_dict())
-    print("Send string:", controller.format_send_string())
+    print("Send string:", controller.format_send_string()[1:].decode("ascii"))
@@ -6,6 +6,7 @@ class RobotController {
     constructor() {
         this.socket = null;
         this.canvas = null;
+        this.state = null;
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 10;
         this.init();
@@ -32,11 +33,23 @@ class RobotController {
 
         // Emit to server
         if (this.socket && this.socket.connected) {
-            const eventName = part === 'leg' ? 'set_leg' : 'set_joint';
-            this.socket.emit(eventName, { side: side, angle: angle });
+            this.sendAngle(side, part, angle);
         }
     }
 
+    sendAngle(side, part, angle) {
+        // The server does not echo our own changes back, so track them here
+        if (this.state) {
+            this.state[`${side}_${part}`].angle = angle;
+        }
+
+        // Binary frame: opcode (bit 1: joint, bit 0: right), int16 LE angle x10
+        const frame = new DataView(new ArrayBuffer(3));
+        frame.setUint8(0, (part === 'joint' ? 2 : 0) | (side === 'right' ? 1 : 0));
+        frame.setInt16(1, Math.round(angle * 10), true);
+        this.socket.emit('cmd', frame.buffer);
+    }
+
     connectSocket() {
         this.socket = io({
             reconnection: true,
@@ -62,11 +75,23 @@ class RobotController {
             this.reconnectAttempts++;
         });
 
+        // Full snapshot, sent on connect / get_status
         this.socket.on('state_update', (state) => {
+            this.state = state;
             this.updateUI(state);
             this.canvas.render(state);
         });
 
+        // Only the parts that changed since the last server tick
+        this.socket.on('state_patch', (patch) => {
+            if (!this.state) return;
+            for (const part in patch) {
+                Object.assign(this.state[part], patch[part]);
+            }
+            this.updateUI(this.state);
+            this.canvas.render(this.state);
+        });
+
         this.socket.on('error', (data) => {
             console.error('Server error:', data.message);
             this.showToast(data.message, 'error');
@@ -99,7 +124,7 @@ class RobotController {
             const state = getCurrentState();
             state.left_leg.angle = angle;
             this.canvas.render(state);
-            this.socket.emit('set_leg', { side: 'left', angle: angle });
+            this.sendAngle('left', 'leg', angle);
         });
 
         const rightLegSlider = document.getElementById('right-leg-slider');
@@ -109,7 +134,7 @@ class RobotController {
             const state = getCurrentState();
             state.right_leg.angle = angle;
             this.canvas.render(state);
-            this.socket.emit('set_leg', { side: 'right', angle: angle });
+            this.sendAngle('right', 'leg', angle);
         });
 
         const leftJointSlider = document.getElementById('left-joint-slider');
@@ -119,7 +144,7 @@ class RobotController {
             const state = getCurrentState();
             state.left_joint.angle = angle;
             this.canvas.render(state);
-            this.socket.emit('set_joint', { side: 'left', angle: angle });
+            this.sendAngle('left', 'joint', angle);
         });
 
         const rightJointSlider = document.getElementById('right-joint-slider');
@@ -129,7 +154,7 @@ class RobotController {
             const state = getCurrentState();
             state.right_joint.angle = angle;
             this.canvas.render(state);
-            this.socket.emit('set_joint', { side: 'right', angle: angle });
+            this.sendAngle('right', 'joint', angle);
         });
     }
 